@@ -11,21 +11,29 @@ LOG = get_logger(__name__)
 
 
 def ensure_binary_or_empty(s: StringType) -> bytes:
+    # Fast paths for the common types, avoiding the call into ensure_binary
+    t = type(s)
+    if t is bytes:
+        return s  # type: ignore[return-value]
+    if t is str:
+        return s.encode("utf-8", "ignore")  # type: ignore[union-attr]
     try:
         return ensure_binary(s)
     except Exception:
         # We don't alert on this situation, we just take it in stride
         return b""
-    return b""
 
 
 # 3.11 and above
 def _sanitize_string_check(value):
     # type: (Any) -> str
-    if isinstance(value, str):
+    # Exact type check first: it is cheaper than isinstance for the common case
+    if type(value) is str:
         return value
     elif value is None:
         return ""
+    elif isinstance(value, str):
+        return value
     try:
         return value.decode("utf-8", "ignore")
     except Exception:
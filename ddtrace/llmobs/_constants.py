@@ -29,3 +29,6 @@ OPENAI_APM_SPAN_NAME = "openai.request"
 INPUT_TOKENS_METRIC_KEY = "input_tokens"
 OUTPUT_TOKENS_METRIC_KEY = "output_tokens"
 TOTAL_TOKENS_METRIC_KEY = "total_tokens"
+
+# The EVP intake rejects payloads larger than 5MB
+EVP_PAYLOAD_SIZE_LIMIT = 5 << 20
@@ -74,12 +74,14 @@ class LLMObs(Service):
             api_key=config._dd_api_key,
             interval=float(os.getenv("_DD_LLMOBS_WRITER_INTERVAL", 1.0)),
             timeout=float(os.getenv("_DD_LLMOBS_WRITER_TIMEOUT", 5.0)),
+            compression=os.getenv("_DD_LLMOBS_WRITER_COMPRESSION"),
         )
         self._llmobs_eval_metric_writer = LLMObsEvalMetricWriter(
             site=config._dd_site,
             api_key=config._dd_api_key,
             interval=float(os.getenv("_DD_LLMOBS_WRITER_INTERVAL", 1.0)),
             timeout=float(os.getenv("_DD_LLMOBS_WRITER_TIMEOUT", 5.0)),
+            compression=os.getenv("_DD_LLMOBS_WRITER_COMPRESSION"),
         )
 
     def _start_service(self) -> None:
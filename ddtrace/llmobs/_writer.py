@@ -1,9 +1,15 @@
 import atexit
+from collections import deque
 import json
 from typing import Any
+from typing import Callable  # noqa:F401
+from typing import Deque  # noqa:F401
 from typing import Dict
 from typing import List
+from typing import Optional
+from typing import Tuple
 from typing import Union
+import zlib
 
 
 # TypedDict was added to typing in python 3.8
@@ -17,10 +23,52 @@ from ddtrace.internal.compat import get_connection_response
 from ddtrace.internal.compat import httplib
 from ddtrace.internal.logger import get_logger
 from ddtrace.internal.periodic import PeriodicService
+from ddtrace.llmobs._constants import EVP_PAYLOAD_SIZE_LIMIT
+
+
+def _stdlib_json_dumps(obj: Any) -> bytes:
+    return json.dumps(obj).encode("utf-8")
+
+
+def _orjson_dumps(obj: Any) -> bytes:
+    try:
+        return orjson.dumps(obj)
+    except TypeError:
+        # orjson rejects values the standard library accepts, like float subclasses
+        # (e.g. numpy.float64), integers wider than 64 bits and non-str dict keys.
+        return _stdlib_json_dumps(obj)
+
+
+# Use orjson when it is available since it is significantly faster than the
+# standard library at serializing the large nested LLMObs events.
+_json_dumps = _stdlib_json_dumps  # type: Callable[[Any], bytes]
+try:
+    import orjson
+
+    _json_dumps = _orjson_dumps
+except ImportError:
+    pass
 
 
 logger = get_logger(__name__)
 
+_SPAN_PAYLOAD_PREFIX = b'{"_dd.stage": "raw", "event_type": "span", "spans": ['
+_SPAN_PAYLOAD_SUFFIX = b"]}"
+_EVAL_METRIC_PAYLOAD_PREFIX = b'{"data": {"type": "evaluation_metric", "attributes": {"metrics": '
+_EVAL_METRIC_PAYLOAD_SUFFIX = b"}}}"
+
+_GZIP_COMPRESSION_LEVEL = 3
+
+
+def _gzip_chunks(chunks: List[bytes]) -> List[bytes]:
+    # Compress the chunks in a single gzip stream without joining them first.
+    # A low level keeps the CPU cost down while the repeated JSON keys still
+    # compress well.
+    compressor = zlib.compressobj(_GZIP_COMPRESSION_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    compressed = [compressor.compress(chunk) for chunk in chunks]
+    compressed.append(compressor.flush())
+    return compressed
+
 
 class LLMObsSpanEvent(TypedDict):
     span_id: str
@@ -52,108 +100,228 @@ class LLMObsEvaluationMetricEvent(TypedDict, total=False):
 class BaseLLMObsWriter(PeriodicService):
     """Base writer class for submitting data to Datadog LLMObs endpoints."""
 
-    def __init__(self, site: str, api_key: str, interval: float, timeout: float) -> None:
+    # Size of the constant payload envelope around the events
+    _envelope_size = 0  # type: int
+
+    def __init__(
+        self, site: str, api_key: str, interval: float, timeout: float, compression: Optional[str] = None
+    ) -> None:
         super(BaseLLMObsWriter, self).__init__(interval=interval)
-        self._lock = forksafe.RLock()
-        self._buffer = []  # type: List[Union[LLMObsSpanEvent, LLMObsEvaluationMetricEvent]]
+        # The buffer lock is never re-entered: events are sent after it is released.
+        self._lock = forksafe.Lock()
         self._buffer_limit = 1000
+        # Ring buffer: when it is full the oldest event is evicted, keeping the freshest data
+        self._buffer = deque(maxlen=self._buffer_limit)  # type: Deque[Union[bytes, LLMObsEvaluationMetricEvent]]
+        self._buffer_size = self._envelope_size  # type: int
+        # Full batches split off on the payload size limit, sent by the periodic thread.
+        # Their events count against the buffer limit.
+        self._pending = []  # type: List[Deque[Union[bytes, LLMObsEvaluationMetricEvent]]]
+        self._pending_count = 0  # type: int
         self._timeout = timeout  # type: float
         self._api_key = api_key or ""  # type: str
         self._endpoint = ""  # type: str
         self._site = site  # type: str
         self._intake = ""  # type: str
+        self._url = ""  # type: str
         self._headers = {"DD-API-KEY": self._api_key, "Content-Type": "application/json"}
+        if compression and compression not in ("none", "gzip"):
+            logger.warning("unsupported LLMObs payload compression %r, payloads will not be compressed", compression)
+        self._gzip = compression == "gzip"  # type: bool
+        if self._gzip:
+            self._headers["Content-Encoding"] = "gzip"
         self._event_type = ""  # type: str
+        self._conn = None  # type: Optional[httplib.HTTPSConnection]
+        # The connection is kept alive across flushes and has to be locked since
+        # the periodic thread can race with the flush triggered on shutdown.
+        self._conn_lck = forksafe.RLock()
 
     def start(self, *args, **kwargs):
         super(BaseLLMObsWriter, self).start()
         logger.debug("started %r to %r", self.__class__.__name__, self._url)
         atexit.register(self.on_shutdown)
+        forksafe.register(self._drop_connection)
+
+    def _stop_service(self, *args, **kwargs):
+        forksafe.unregister(self._drop_connection)
+        super(BaseLLMObsWriter, self)._stop_service(*args, **kwargs)
 
     def on_shutdown(self):
         self.periodic()
+        self._reset_connection()
 
-    def _enqueue(self, event: Union[LLMObsSpanEvent, LLMObsEvaluationMetricEvent]) -> None:
+    def _enqueue(self, event: Union[bytes, LLMObsEvaluationMetricEvent], event_size: int = 0) -> None:
+        if self._envelope_size + event_size > EVP_PAYLOAD_SIZE_LIMIT:
+            logger.warning(
+                "dropping LLMObs %s event of %d bytes, larger than the payload size limit of %d bytes",
+                self._event_type,
+                event_size,
+                EVP_PAYLOAD_SIZE_LIMIT,
+            )
+            return
         with self._lock:
-            if len(self._buffer) >= self._buffer_limit:
-                logger.warning(
-                    "%r event buffer full (limit is %d), dropping event", self.__class__.__name__, self._buffer_limit
-                )
-                return
+            if self._buffer and self._buffer_size + event_size > EVP_PAYLOAD_SIZE_LIMIT:
+                # Split the buffered events off so that a single payload never exceeds the
+                # intake size limit. The batch is sent on the next interval: waking the
+                # periodic thread would block this thread until the request completes.
+                self._pending.append(self._buffer)
+                self._pending_count += len(self._buffer)
+                self._buffer = deque(maxlen=self._buffer_limit)
+                self._buffer_size = self._envelope_size
+            if self._pending_count + len(self._buffer) >= self._buffer_limit:
+                if self._pending:
+                    dropped = self._pending.pop(0)
+                    self._pending_count -= len(dropped)
+                    logger.warning(
+                        "%r event buffer full (limit is %d), dropping %d oldest events",
+                        self.__class__.__name__,
+                        self._buffer_limit,
+                        len(dropped),
+                    )
+                else:
+                    logger.warning(
+                        "%r event buffer full (limit is %d), dropping oldest event",
+                        self.__class__.__name__,
+                        self._buffer_limit,
+                    )
+                    self._buffer_size -= self._event_size(self._buffer[0])
             self._buffer.append(event)
+            self._buffer_size += event_size
 
     def periodic(self) -> None:
+        # Reading the buffer length is atomic under the GIL, so idle intervals
+        # can return early without taking the lock.
+        if not self._buffer and not self._pending:
+            return
         with self._lock:
-            if not self._buffer:
-                return
-            events = self._buffer
-            self._buffer = []
+            batches = self._pending
+            self._pending = []
+            self._pending_count = 0
+            if self._buffer:
+                batches.append(self._buffer)
+                self._buffer = deque(maxlen=self._buffer_limit)
+                self._buffer_size = self._envelope_size
+        for events in batches:
+            self._send_events(events)
 
-        data = self._data(events)
+    def _send_events(self, events: Deque[Any]) -> None:
         try:
-            enc_llm_events = json.dumps(data)
+            enc_llm_events = self._encode(events)
         except TypeError:
             logger.error("failed to encode %d LLMObs %s events", len(events), self._event_type, exc_info=True)
             return
-        conn = httplib.HTTPSConnection(self._intake, 443, timeout=self._timeout)
+        if self._gzip:
+            enc_llm_events = _gzip_chunks(enc_llm_events)
+        # The payload chunks are written to the socket one after the other,
+        # so the request body is never copied into a single buffer.
+        headers = dict(self._headers)
+        headers["Content-Length"] = str(sum(len(chunk) for chunk in enc_llm_events))
         try:
-            conn.request("POST", self._endpoint, enc_llm_events, self._headers)
-            resp = get_connection_response(conn)
-            if resp.status >= 300:
-                logger.error(
-                    "failed to send %d LLMObs %s events to %s, got response code %d, status: %s",
-                    len(events),
-                    self._event_type,
-                    self._url,
-                    resp.status,
-                    resp.read(),
-                )
-            else:
-                logger.debug("sent %d LLMObs %s events to %s", len(events), self._event_type, self._url)
+            status, body = self._post(enc_llm_events, headers)
         except Exception:
             logger.error(
                 "failed to send %d LLMObs %s events to %s", len(events), self._event_type, self._intake, exc_info=True
             )
-        finally:
-            conn.close()
+            return
+        if status >= 300:
+            logger.error(
+                "failed to send %d LLMObs %s events to %s, got response code %d, status: %s",
+                len(events),
+                self._event_type,
+                self._url,
+                status,
+                body,
+            )
+        else:
+            logger.debug("sent %d LLMObs %s events to %s", len(events), self._event_type, self._url)
+
+    def _post(self, payload: List[bytes], headers: Dict[str, str]) -> Tuple[int, bytes]:
+        with self._conn_lck:
+            reused = self._conn is not None
+            if self._conn is None:
+                self._conn = httplib.HTTPSConnection(self._intake, 443, timeout=self._timeout)
+            try:
+                self._conn.request("POST", self._endpoint, payload, headers)
+                resp = get_connection_response(self._conn)
+                # The response body has to be consumed before the connection can be reused
+                return resp.status, resp.read()
+            except ConnectionError:
+                self._reset_connection()
+                if not reused:
+                    raise
+                # The intake may have closed the idle keep-alive connection before
+                # receiving the request, so retry once on a new connection.
+                return self._post(payload, headers)
+            except Exception:
+                # Always reset the connection when an exception occurs
+                self._reset_connection()
+                raise
+
+    def _reset_connection(self) -> None:
+        with self._conn_lck:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
 
-    @property
-    def _url(self) -> str:
-        return "https://%s%s" % (self._intake, self._endpoint)
+    def _drop_connection(self) -> None:
+        # The socket is shared with the parent process after a fork, so the child
+        # must not close it and simply opens a new connection on the next flush.
+        self._conn = None
 
-    def _data(self, events: List[Any]) -> Dict[str, Any]:
+    def _event_size(self, event: Any) -> int:
+        return 0
+
+    def _encode(self, events: Deque[Any]) -> List[bytes]:
         raise NotImplementedError
 
 
 class LLMObsSpanWriter(BaseLLMObsWriter):
     """Writer to the Datadog LLMObs Span Event Endpoint."""
 
-    def __init__(self, site: str, api_key: str, interval: float, timeout: float) -> None:
-        super(LLMObsSpanWriter, self).__init__(site, api_key, interval, timeout)
+    _envelope_size = len(_SPAN_PAYLOAD_PREFIX) + len(_SPAN_PAYLOAD_SUFFIX)
+
+    def __init__(
+        self, site: str, api_key: str, interval: float, timeout: float, compression: Optional[str] = None
+    ) -> None:
+        super(LLMObsSpanWriter, self).__init__(site, api_key, interval, timeout, compression)
         self._event_type = "span"
-        self._buffer = []
         self._endpoint = "/api/v2/llmobs"  # type: str
         self._intake = "llmobs-intake.%s" % self._site  # type: str
+        self._url = "https://%s%s" % (self._intake, self._endpoint)
 
     def enqueue(self, event: LLMObsSpanEvent) -> None:
-        self._enqueue(event)
+        # Span events are encoded once on enqueue: the encoded size is needed for
+        # the payload size accounting and the bytes are reused as-is on flush.
+        try:
+            enc_event = _json_dumps(event)
+        except TypeError:
+            logger.error("failed to encode LLMObs %s event, dropping event", self._event_type, exc_info=True)
+            return
+        self._enqueue(enc_event, self._event_size(enc_event))
+
+    def _event_size(self, event: bytes) -> int:
+        # Account for the comma joining the event to the previous one in the payload
+        return len(event) + 1
 
-    def _data(self, events: List[LLMObsSpanEvent]) -> Dict[str, Any]:
-        return {"_dd.stage": "raw", "event_type": "span", "spans": events}
+    def _encode(self, events: Deque[bytes]) -> List[bytes]:
+        # The payload envelope is constant and the events are already encoded.
+        return [_SPAN_PAYLOAD_PREFIX, b",".join(events), _SPAN_PAYLOAD_SUFFIX]
 
 
 class LLMObsEvalMetricWriter(BaseLLMObsWriter):
     """Writer to the Datadog LLMObs Custom Eval Metrics Endpoint."""
 
-    def __init__(self, site: str, api_key: str, interval: float, timeout: float) -> None:
-        super(LLMObsEvalMetricWriter, self).__init__(site, api_key, interval, timeout)
+    def __init__(
+        self, site: str, api_key: str, interval: float, timeout: float, compression: Optional[str] = None
+    ) -> None:
+        super(LLMObsEvalMetricWriter, self).__init__(site, api_key, interval, timeout, compression)
         self._event_type = "evaluation_metric"
-        self._buffer = []
         self._endpoint = "/api/unstable/llm-obs/v1/eval-metric"
         self._intake = "api.%s" % self._site  # type: str
+        self._url = "https://%s%s" % (self._intake, self._endpoint)
 
     def enqueue(self, event: LLMObsEvaluationMetricEvent) -> None:
         self._enqueue(event)
 
-    def _data(self, events: List[LLMObsEvaluationMetricEvent]) -> Dict[str, Any]:
-        return {"data": {"type": "evaluation_metric", "attributes": {"metrics": events}}}
+    def _encode(self, events: Deque[LLMObsEvaluationMetricEvent]) -> List[bytes]:
+        # The payload envelope is constant, so only the metrics need to be serialized.
+        return [_EVAL_METRIC_PAYLOAD_PREFIX, _json_dumps(list(events)), _EVAL_METRIC_PAYLOAD_SUFFIX]
@@ -32,7 +32,7 @@ from tests.utils import override_config
 GROUP_ID = "test_group"
 BOOTSTRAP_SERVERS = "localhost:{}".format(KAFKA_CONFIG["port"])
 KEY = "test_key"
-PAYLOAD = bytes("hueh hueh hueh", encoding="utf-8")
+PAYLOAD = b"hueh hueh hueh"
 DSM_TEST_PATH_HEADER_SIZE = 28
 
 
@@ -414,7 +414,7 @@ def test_data_streams_payload_size(dsm_processor, consumer, producer, kafka_topi
 
 
 def test_data_streams_kafka_serializing(dsm_processor, deserializing_consumer, serializing_producer, kafka_topic):
-    PAYLOAD = bytes("data streams", encoding="utf-8")
+    PAYLOAD = b"data streams"
     try:
         del dsm_processor._current_context.value
     except AttributeError:
@@ -429,7 +429,7 @@ def test_data_streams_kafka_serializing(dsm_processor, deserializing_consumer, s
 
 
 def test_data_streams_kafka(dsm_processor, consumer, producer, kafka_topic):
-    PAYLOAD = bytes("data streams", encoding="utf-8")
+    PAYLOAD = b"data streams"
     try:
         del dsm_processor._current_context.value
     except AttributeError:
@@ -480,7 +480,7 @@ def _generate_in_subprocess(random_topic):
     from ddtrace.contrib.kafka.patch import unpatch
     from tests.contrib.kafka.test_kafka import KafkaConsumerPollFilter
 
-    PAYLOAD = bytes("hueh hueh hueh", encoding="utf-8")
+    PAYLOAD = b"hueh hueh hueh"
 
     ddtrace.tracer.configure(settings={"FILTERS": [KafkaConsumerPollFilter()]})
     # disable backoff because it makes these tests less reliable
@@ -574,7 +574,7 @@ def test_data_streams_kafka_offset_monitoring_messages(dsm_processor, non_auto_c
                 consumer.commit(asynchronous=False, message=message)
                 return message
 
-    PAYLOAD = bytes("data streams", encoding="utf-8")
+    PAYLOAD = b"data streams"
     consumer = non_auto_commit_consumer
     try:
         del dsm_processor._current_context.value
@@ -618,7 +618,7 @@ def test_data_streams_kafka_offset_monitoring_offsets(dsm_processor, non_auto_co
                 return message
 
     consumer = non_auto_commit_consumer
-    PAYLOAD = bytes("data streams", encoding="utf-8")
+    PAYLOAD = b"data streams"
     try:
         del dsm_processor._current_context.value
     except AttributeError:
@@ -655,7 +655,7 @@ def test_data_streams_kafka_offset_monitoring_auto_commit(dsm_processor, consume
             if message:
                 return message
 
-    PAYLOAD = bytes("data streams", encoding="utf-8")
+    PAYLOAD = b"data streams"
     try:
         del dsm_processor._current_context.value
     except AttributeError:
@@ -688,7 +688,7 @@ def test_data_streams_kafka_offset_monitoring_auto_commit(dsm_processor, consume
 def test_data_streams_kafka_produce_api_compatibility(dsm_processor, consumer, producer, empty_kafka_topic):
     kafka_topic = empty_kafka_topic
 
-    PAYLOAD = bytes("data streams", encoding="utf-8")
+    PAYLOAD = b"data streams"
     try:
         del dsm_processor._current_context.value
     except AttributeError:
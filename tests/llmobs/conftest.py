@@ -53,6 +53,15 @@ def mock_writer_logs():
         yield m
 
 
+@pytest.fixture
+def mock_intake_conn():
+    with mock.patch("ddtrace.llmobs._writer.httplib.HTTPSConnection") as mock_conn_cls, mock.patch(
+        "ddtrace.llmobs._writer.get_connection_response"
+    ) as mock_get_response:
+        mock_get_response.return_value.status = 202
+        yield mock_conn_cls
+
+
 @pytest.fixture
 def ddtrace_global_config():
     config = {}
@@ -1,3 +1,4 @@
+import json
 import os
 import time
 
@@ -53,10 +54,34 @@ def test_buffer_limit(mock_writer_logs):
     for _ in range(1001):
         llmobs_eval_metric_writer.enqueue({})
     mock_writer_logs.warning.assert_called_with(
-        "%r event buffer full (limit is %d), dropping event", "LLMObsEvalMetricWriter", 1000
+        "%r event buffer full (limit is %d), dropping oldest event", "LLMObsEvalMetricWriter", 1000
     )
 
 
+def test_encode_payload():
+    llmobs_eval_metric_writer = LLMObsEvalMetricWriter(site="datad0g.com", api_key="asdf", interval=1000, timeout=1)
+    events = [_categorical_metric_event(), _score_metric_event(), _numerical_metric_event()]
+    for event in events:
+        llmobs_eval_metric_writer.enqueue(event)
+    assert json.loads(b"".join(llmobs_eval_metric_writer._encode(llmobs_eval_metric_writer._buffer))) == {
+        "data": {"type": "evaluation_metric", "attributes": {"metrics": events}}
+    }
+
+
+def test_encode_payload_float_subclass():
+    class Score(float):
+        pass
+
+    # Float subclasses like numpy.float64 are rejected by orjson and fall back to the stdlib encoder
+    llmobs_eval_metric_writer = LLMObsEvalMetricWriter(site="datad0g.com", api_key="asdf", interval=1000, timeout=1)
+    event = _score_metric_event()
+    event["score_value"] = Score(0.9)
+    llmobs_eval_metric_writer.enqueue(event)
+    assert json.loads(b"".join(llmobs_eval_metric_writer._encode(llmobs_eval_metric_writer._buffer))) == {
+        "data": {"type": "evaluation_metric", "attributes": {"metrics": [_score_metric_event()]}}
+    }
+
+
 @pytest.mark.vcr_logs
 def test_send_metric_bad_api_key(mock_writer_logs):
     llmobs_eval_metric_writer = LLMObsEvalMetricWriter(
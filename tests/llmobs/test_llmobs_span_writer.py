@@ -1,3 +1,5 @@
+import gzip
+import json
 import os
 import time
 
@@ -5,6 +7,7 @@ import mock
 import pytest
 
 from ddtrace.llmobs._writer import LLMObsSpanWriter
+from ddtrace.llmobs._writer import _json_dumps
 
 
 INTAKE_ENDPOINT = "https://llmobs-intake.datad0g.com/api/v2/llmobs"
@@ -90,11 +93,164 @@ def test_writer_start(mock_writer_logs):
 
 def test_buffer_limit(mock_writer_logs):
     llmobs_span_writer = LLMObsSpanWriter(site="datad0g.com", api_key="asdf", interval=1000, timeout=1)
-    for _ in range(1001):
-        llmobs_span_writer.enqueue({})
+    for i in range(1001):
+        llmobs_span_writer.enqueue({"span_id": str(i)})
     mock_writer_logs.warning.assert_called_with(
-        "%r event buffer full (limit is %d), dropping event", "LLMObsSpanWriter", 1000
+        "%r event buffer full (limit is %d), dropping oldest event", "LLMObsSpanWriter", 1000
     )
+    assert len(llmobs_span_writer._buffer) == 1000
+    assert json.loads(llmobs_span_writer._buffer[0]) == {"span_id": "1"}
+    assert json.loads(llmobs_span_writer._buffer[-1]) == {"span_id": "1000"}
+    assert llmobs_span_writer._buffer_size == llmobs_span_writer._envelope_size + sum(
+        len(e) + 1 for e in llmobs_span_writer._buffer
+    )
+
+
+def _large_event():
+    event = _completion_event()
+    event["meta"]["input"]["messages"][0]["content"] = "A" * (1 << 20)
+    return event
+
+
+def test_flush_on_payload_size_limit(mock_writer_logs, mock_intake_conn):
+    llmobs_span_writer = LLMObsSpanWriter(site="datad0g.com", api_key="asdf", interval=1000, timeout=1)
+    for _ in range(4):
+        llmobs_span_writer.enqueue(_large_event())
+    mock_intake_conn.return_value.request.assert_not_called()
+    llmobs_span_writer.enqueue(_large_event())
+    # The full batch is split off but only sent from the periodic thread
+    mock_intake_conn.return_value.request.assert_not_called()
+    assert [len(events) for events in llmobs_span_writer._pending] == [4]
+    assert len(llmobs_span_writer._buffer) == 1
+    llmobs_span_writer.periodic()
+    assert mock_intake_conn.return_value.request.call_count == 2
+    mock_writer_logs.debug.assert_has_calls(
+        [
+            mock.call("sent %d LLMObs %s events to %s", 4, "span", INTAKE_ENDPOINT),
+            mock.call("sent %d LLMObs %s events to %s", 1, "span", INTAKE_ENDPOINT),
+        ]
+    )
+    assert not llmobs_span_writer._pending
+    assert not llmobs_span_writer._buffer
+
+
+def test_payload_size_limit_includes_envelope():
+    llmobs_span_writer = LLMObsSpanWriter(site="datad0g.com", api_key="asdf", interval=1000, timeout=1)
+    event_size = len(_json_dumps({"span_id": "0"}))
+    # The events alone fit in the limit, but not with the envelope and the commas between them
+    size_limit = 10 * event_size
+    with mock.patch("ddtrace.llmobs._writer.EVP_PAYLOAD_SIZE_LIMIT", size_limit):
+        for i in range(10):
+            llmobs_span_writer.enqueue({"span_id": str(i)})
+    assert llmobs_span_writer._pending
+    for events in llmobs_span_writer._pending + [llmobs_span_writer._buffer]:
+        assert len(b"".join(llmobs_span_writer._encode(events))) <= size_limit
+
+
+def test_oversized_event_dropped(mock_writer_logs):
+    llmobs_span_writer = LLMObsSpanWriter(site="datad0g.com", api_key="asdf", interval=1000, timeout=1)
+    with mock.patch("ddtrace.llmobs._writer.EVP_PAYLOAD_SIZE_LIMIT", 100):
+        llmobs_span_writer.enqueue(_completion_event())
+    mock_writer_logs.warning.assert_called_once_with(
+        "dropping LLMObs %s event of %d bytes, larger than the payload size limit of %d bytes", "span", mock.ANY, 100
+    )
+    assert not llmobs_span_writer._buffer
+
+
+def test_pending_batches_count_against_buffer_limit(mock_writer_logs):
+    llmobs_span_writer = LLMObsSpanWriter(site="datad0g.com", api_key="asdf", interval=1000, timeout=1)
+    with mock.patch("ddtrace.llmobs._writer.EVP_PAYLOAD_SIZE_LIMIT", 200):
+        for i in range(1001):
+            llmobs_span_writer.enqueue({"span_id": str(i)})
+    mock_writer_logs.warning.assert_called_with(
+        "%r event buffer full (limit is %d), dropping %d oldest events", "LLMObsSpanWriter", 1000, mock.ANY
+    )
+    assert llmobs_span_writer._pending_count == sum(len(events) for events in llmobs_span_writer._pending)
+    assert llmobs_span_writer._pending_count + len(llmobs_span_writer._buffer) <= 1000
+    assert json.loads(llmobs_span_writer._buffer[-1]) == {"span_id": "1000"}
+
+
+def test_encode_payload():
+    llmobs_span_writer = LLMObsSpanWriter(site="datad0g.com", api_key="asdf", interval=1000, timeout=1)
+    events = [_completion_event(), _chat_completion_event()]
+    for event in events:
+        llmobs_span_writer.enqueue(event)
+    assert json.loads(b"".join(llmobs_span_writer._encode(llmobs_span_writer._buffer))) == {
+        "_dd.stage": "raw",
+        "event_type": "span",
+        "spans": events,
+    }
+
+
+def test_connection_reused_across_flushes(mock_writer_logs, mock_intake_conn):
+    llmobs_span_writer = LLMObsSpanWriter(site="datad0g.com", api_key="asdf", interval=1000, timeout=1)
+    llmobs_span_writer.enqueue(_completion_event())
+    llmobs_span_writer.periodic()
+    llmobs_span_writer.enqueue(_chat_completion_event())
+    llmobs_span_writer.periodic()
+    mock_intake_conn.assert_called_once_with("llmobs-intake.datad0g.com", 443, timeout=1)
+    assert mock_intake_conn.return_value.request.call_count == 2
+    mock_intake_conn.return_value.close.assert_not_called()
+
+
+def test_stale_connection_retried(mock_writer_logs, mock_intake_conn):
+    llmobs_span_writer = LLMObsSpanWriter(site="datad0g.com", api_key="asdf", interval=1000, timeout=1)
+    llmobs_span_writer.enqueue(_completion_event())
+    llmobs_span_writer.periodic()
+    mock_intake_conn.return_value.request.side_effect = [ConnectionResetError(), None]
+    llmobs_span_writer.enqueue(_chat_completion_event())
+    llmobs_span_writer.periodic()
+    assert mock_intake_conn.call_count == 2
+    mock_writer_logs.error.assert_not_called()
+    mock_writer_logs.debug.assert_called_with("sent %d LLMObs %s events to %s", 1, "span", INTAKE_ENDPOINT)
+
+
+def test_gzip_compression(mock_writer_logs, mock_intake_conn):
+    llmobs_span_writer = LLMObsSpanWriter(
+        site="datad0g.com", api_key="asdf", interval=1000, timeout=1, compression="gzip"
+    )
+    llmobs_span_writer.enqueue(_completion_event())
+    llmobs_span_writer.periodic()
+    _, _, body, headers = mock_intake_conn.return_value.request.call_args[0]
+    payload = b"".join(body)
+    assert headers["Content-Encoding"] == "gzip"
+    assert headers["Content-Length"] == str(len(payload))
+    assert json.loads(gzip.decompress(payload)) == {
+        "_dd.stage": "raw",
+        "event_type": "span",
+        "spans": [_completion_event()],
+    }
+
+
+def test_connection_reset_on_error(mock_writer_logs, mock_intake_conn):
+    mock_intake_conn.return_value.request.side_effect = OSError("connection reset")
+    llmobs_span_writer = LLMObsSpanWriter(site="datad0g.com", api_key="asdf", interval=1000, timeout=1)
+    llmobs_span_writer.enqueue(_completion_event())
+    llmobs_span_writer.periodic()
+    mock_intake_conn.return_value.close.assert_called_once_with()
+    assert llmobs_span_writer._conn is None
+
+
+def test_connection_dropped_after_fork(mock_writer_logs, mock_intake_conn):
+    llmobs_span_writer = LLMObsSpanWriter(site="datad0g.com", api_key="asdf", interval=1000, timeout=1)
+    llmobs_span_writer.enqueue(_completion_event())
+    llmobs_span_writer.periodic()
+    # The child must not close the socket it shares with the parent process
+    llmobs_span_writer._drop_connection()
+    mock_intake_conn.return_value.close.assert_not_called()
+    assert llmobs_span_writer._conn is None
+    llmobs_span_writer.enqueue(_chat_completion_event())
+    llmobs_span_writer.periodic()
+    assert mock_intake_conn.call_count == 2
+
+
+def test_connection_closed_on_shutdown(mock_writer_logs, mock_intake_conn):
+    llmobs_span_writer = LLMObsSpanWriter(site="datad0g.com", api_key="asdf", interval=1000, timeout=1)
+    llmobs_span_writer.enqueue(_completion_event())
+    llmobs_span_writer.on_shutdown()
+    mock_intake_conn.return_value.request.assert_called_once()
+    mock_intake_conn.return_value.close.assert_called_once_with()
+    assert llmobs_span_writer._conn is None
 
 
 @pytest.mark.vcr_logs
@@ -166,6 +322,7 @@ import os
 import time
 
 from ddtrace.llmobs._writer import LLMObsSpanWriter
+from ddtrace.llmobs._writer import _json_dumps
 from tests.llmobs.test_llmobs_span_writer import _completion_event
 from tests.llmobs._utils import logs_vcr
 